@@ -19,14 +19,21 @@ following resources:
 """
 
 import os
-import http.cookiejar as cookielib
+import asyncio
+import atexit
 import urllib.parse as urllib
-import urllib.request as urllib2
 import re
 import shutil
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from sys import stderr
 from getpass import getpass
-from codecs import lookup as lookup_codec
+from html import unescape
+from functools import lru_cache
+from email.message import Message
+from email.utils import parsedate_to_datetime
+import requests
 from extension_map import FILE_EXT_MAP
 
 __author__ = "Christopher Bull, Shawn Richards"
@@ -39,24 +46,28 @@ DEBUG = True
 MAX_FILE_NAME_LEN = 259
 PATH_STORAGE_FN = "OrigFNames.txt"
 MAX_FOLDER_NAME_LEN = MAX_FILE_NAME_LEN - len(PATH_STORAGE_FN) - 1 # -1 accounts for slash divider
+MAX_CONCURRENT_DOWNLOADS = 8 # number of worker threads making requests to Learn
+COPY_BUFFER_SIZE = 1024*1024 # bytes read per write when saving a download
+MAX_OPEN_PATH_LOGS = 16 # PATH_STORAGE_FN log files kept open at once
+
+forbidden_fn_chars_table = str.maketrans('', '', ':*?"<>|') # deletes these chars
+rn_fn_re = re.compile(r'rn(\d+)(?:\.\w+)?$')
+rename_log_re = re.compile(r"'(.*)' ==> '(.*)'$")
+
+# Learn page scraping
+form_re = re.compile(r'<form class="m-t-1"')
+token_re = re.compile(r'<input type="hidden" name="logintoken" value="(\w*)">')
+# The (?s:.*?) groups capture everything between a start and end marker
+course_list_re = re.compile(r'<li class="dropdown nav-item">\s+<a .*>\s+My Courses\s+</a>((?s:.*?))</li>')
+course_re = re.compile(r'<a class="dropdown-item" role="menuitem" href=".*?id=(\d*)" title="((?:[A-Z]{4}\d{3})(?:-[A-Z]{4}\d{3})*).*?">(.*?)</a>')
+table_re = re.compile(r'<div role="main"><span id="maincontent"></span><table class="generaltable mod_index">((?s:.*?))</table>\n*</div>')
+cell_re = re.compile(r'<td class="cell c1" style="text-align:left;">(.*?)</td>')
+text_re = re.compile(r'href="(.*)".*src=".*/(?:icon|f/(\w+))".*alt="([\w|\s]*)" />\s?(.+)</a>')
+learn_url_re = re.compile(r'https://learn\.canterbury\.ac\.nz/.*')
+dl_url_re = re.compile(r'Click <a href="(.*?)">(.*?)\.pdf</a> link to download the file\.')
+folder_re = re.compile(r'<form.*?action="(.*?)" >\n.*?name="id" value="(\d+)">')
+dl_re = re.compile(r'<div role="main">.*?<h2>(.*?)</h2>.*?href="(.*?)"')
 
-forbidden_fn_chars_re = re.compile(r'[:\*\?"<>\|]')
-
-
-def get_encoding(content_type, url):
-    """Attempt to get the encoding type of the downloaded file"""
-    encoding_matches = re.findall(r"charset=(.*)?", content_type)
-    if len(encoding_matches) > 0:
-        encoding = encoding_matches[0]
-        if len(encoding_matches) > 1:
-            print("\nWarning: more than one encoding type declared!", file=stderr)
-            print(f"Will attempt to use the first type found ({encoding})\n", file=stderr)
-    else:
-        print(f"Error: content_type = '{content_type}', attempting to decode with latin-1", file=stderr)
-        print(url, file=stderr)
-        encoding = 'latin-1'
-    return encoding
-    
 
 
 class learnUserObj(object):
@@ -78,20 +89,45 @@ class learnUserObj(object):
         self.login = login
         self.password = password
 
-        self.cj = cookielib.CookieJar()
-        self.opener = urllib2.build_opener(
-            urllib2.HTTPRedirectHandler(),
-            urllib2.HTTPHandler(debuglevel=0),
-            urllib2.HTTPSHandler(debuglevel=0),
-            urllib2.HTTPCookieProcessor(self.cj)
-        )
-        user_agent = ("Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.2; .NET CLR 1.1.4322)")
-        self.opener.addheaders = [
-            ('User-agent', user_agent)
-        ]
+        # The cookies set by logging in. Each thread's session (see `sess`)
+        # starts with its own copy of these, as requests does not lock a
+        # session's cookie jar while reading it.
+        self.cj = requests.cookies.RequestsCookieJar()
+        self.thread_data = threading.local()
+        # Serialises the renaming of long file names between threads
+        self.fs_lock = threading.Lock()
+        # Maps folders to the next free index for renamed files
+        self.rn_counters = {}
+        # Maps folders to their open PATH_STORAGE_FN log file
+        self.path_log_handles = {}
+        # Maps folders to the {original path: shortened path} renames
+        # recorded in their PATH_STORAGE_FN log
+        self.renamed_paths = {}
+        atexit.register(self.close_path_logs)
         
         self.loginToLearn()
 
+
+    @property
+    def sess(self):
+        """
+        The requests session belonging to the calling thread.
+        
+        A session keeps its connection to Learn alive between requests,
+        avoiding a new TCP/TLS handshake for every page/file.
+        """
+        sess = getattr(self.thread_data, 'sess', None)
+        if sess is None:
+            sess = requests.Session()
+            sess.cookies = self.cj.copy()
+            user_agent = ("Mozilla/4.0 (compatible; MSIE 6.0; Windows NT 5.2; .NET CLR 1.1.4322)")
+            sess.headers.update({'User-Agent': user_agent})
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                                    pool_maxsize=1)
+            sess.mount('https://', adapter)
+            self.thread_data.sess = sess
+        return sess
+
         
     def loginToLearn(self):
         """
@@ -104,20 +140,22 @@ class learnUserObj(object):
         #Get the login token
         decoded_webpage = self.openWebpage("https://learn.canterbury.ac.nz")
         
-        form_re = re.compile(r'(<form class="m-t-1"(?:.*\n)*.*</form>)')
-        form_section = form_re.search(decoded_webpage).group(1)
+        # Search for the token from the start of the login form onwards
+        # rather than capturing the whole form, which backtracks over the
+        # rest of the page
+        form_start = form_re.search(decoded_webpage).end()
 
-        token_re = re.compile(r'<input type="hidden" name="logintoken" value="(\w*)">')
-        login_token = token_re.search(form_section).group(1)
+        login_token = token_re.search(decoded_webpage, form_start).group(1)
         
-        login_data = urllib.urlencode({
+        login_data = {
             'username' : self.login,
             'password' : self.password,
             'logintoken' : login_token
-        }).encode('utf-8')
+        }
         
         #Login (setting cookies)
         decoded_webpage = self.openWebpage(LEARN_LOGIN_URL, login_data)
+        self.cj = self.sess.cookies.copy()
 
     
     def openWebpage(self, url, data=None):
@@ -128,8 +166,9 @@ class learnUserObj(object):
         ----------
         url : str
             The unencoded URL of the server to contact.
-        data : bytes, optional
-            Additional data to send to the server (default is None).
+        data : dict, optional
+            Form data to POST to the server (default is None, which
+            sends a GET request instead).
         
         Returns
         -------
@@ -138,38 +177,65 @@ class learnUserObj(object):
         
         Raises
         ------
-        UnicodeDecodeError
-            If the received webpage could not be decoded.
+        requests.HTTPError
+            If the server responded with an error status.
         """
         
-        response = self.opener.open(url, data)
-        encoding = get_encoding(response.info()['Content-Type'], url)
-        encoded_webpage = b''.join(response.readlines())
-        
-        try:
-            decoded_webpage = encoded_webpage.decode(encoding)
-        except UnicodeDecodeError as e:
-            print("\Error, could not decode the following:")
-            print(encoded_webpage)
-            raise e
+        if data is None:
+            response = self.sess.get(url)
         else:
-            return decoded_webpage
+            response = self.sess.post(url, data=data)
+        response.raise_for_status()
+        if response.encoding is None:
+            # No charset was declared. Fall back to latin-1 rather than
+            # having requests guess by scanning the whole page.
+            response.encoding = 'latin-1'
+        return response.text
     
     
     def get_header(self, url):
         """return the header for the file at `url`"""
-        response = self.opener.open(url)
-        return response.info()
+        response = self.sess.head(url, allow_redirects=True)
+        response.raise_for_status()
+        return response.headers
 
         
-    def downloadFile(self, url, dest_folder, learn_name):
-        """Download file retrieved from `url` to `dest_folder`."""
-        response = self.opener.open(url)
+    def downloadFile(self, url, dest_folder, learn_name, header=None):
+        """
+        Download file retrieved from `url` to `dest_folder`.
         
-        filename = self.get_filename(response, learn_name)
+        The file is named from its `header`, and skipped if it is already
+        up to date on disk. If no `header` is given, the response headers
+        of the download request itself are used, and its body is only
+        read if the file needs downloading.
+        """
+        if header is None:
+            with self.sess.get(url, stream=True) as response:
+                response.raise_for_status()
+                dest = self.get_dest(response.headers, dest_folder,
+                                     learn_name)
+                if dest is not None and not DEBUG:
+                    self.save_response(response, dest)
+        else:
+            dest = self.get_dest(header, dest_folder, learn_name)
+            if dest is not None and not DEBUG:
+                with self.sess.get(url, stream=True) as response:
+                    response.raise_for_status()
+                    self.save_response(response, dest)
+    
+    
+    def get_dest(self, header, dest_folder, learn_name):
+        """
+        Return the path in `dest_folder` to save the file described by
+        `header` to, or None if the file there is already up to date.
+        
+        Any folders needed are created and long paths shortened (and
+        logged) along the way.
+        """
+        filename = self.get_filename(header, learn_name)
         print(f"Downloading '{filename}'")
 
-        media_type, encoding = self.get_content_type(response)
+        media_type, encoding = self.get_content_type(header)
         if media_type in FILE_EXT_MAP:
             if not FILE_EXT_MAP[media_type] == None:
                 is_known_type = True
@@ -177,113 +243,267 @@ class learnUserObj(object):
                 is_known_type = False
         else:
             is_known_type = False
-        
+    
         if is_known_type:
             ext = FILE_EXT_MAP[media_type]
             full_fn = f"{filename}.{ext}"
         else:
-            print(f"\nA file of the unknown type '{content_type}' was ",
+            print(f"\nA file of the unknown type '{media_type}' was ",
                   f"found.\nIt will be saved as '{filename}' without an ",
                   "extension. If possible, please identify the correct ",
                   "file extension and add it to the file type map.\n", file=stderr)
             full_fn = filename
+    
+        dest_folder = unescape(dest_folder)
+        dest_folder = os.path.abspath(urllib.unquote(dest_folder))
         
-        amp_re = re.compile(r'&amp;?')
-        dest_folder = amp_re.sub('&', dest_folder)
-        dest_folder = urllib.unquote(dest_folder)
-        
-        dest_folder = os.path.abspath(dest_folder)
-        dest = os.path.abspath(f"{dest_folder}/{full_fn}")
-        
-        rel_path = os.path.relpath(dest)
-        rel_path2 = os.path.relpath(forbidden_fn_chars_re.sub('', rel_path))
+        # The drive (e.g. 'C:') is kept out of the character stripping
+        drive, folder_path = os.path.splitdrive(dest_folder)
+        folder_path2 = folder_path.translate(forbidden_fn_chars_table)
+        full_fn2 = full_fn.translate(forbidden_fn_chars_table)
         
-        if not rel_path == rel_path2:
+        if folder_path != folder_path2 or full_fn != full_fn2:
+            path = os.path.join(dest_folder, full_fn)
+            dest_folder = drive + folder_path2
+            full_fn = full_fn2
+            path2 = os.path.join(dest_folder, full_fn)
             print("\nWarning! The following characters cannot be used in file and folder names:", file=stderr)
             print(r"    \ / : * ? < > |", file=stderr)
-            print(f"The file named '{rel_path}' has been renamed to '{rel_path2}' accordingly.\n", file=stderr)
-            
-            rel_dest_folder = os.path.relpath(dest_folder)
-            rel_dest_folder2 = forbidden_fn_chars_re.sub('', rel_dest_folder)
-            dest_folder = os.path.abspath(rel_dest_folder2)
-            full_fn = forbidden_fn_chars_re.sub('', full_fn)
-            dest = os.path.abspath(f"{dest_folder}/{full_fn}")
+            print(f"The file named '{path}' has been renamed to '{path2}' accordingly.\n", file=stderr)
         
+        dest = os.path.join(dest_folder, full_fn)
+    
         orig_path = dest
         if len(dest_folder) > MAX_FOLDER_NAME_LEN:
             dest_folder = dest_folder[:MAX_FOLDER_NAME_LEN]
-            dest = os.path.abspath(f"{dest_folder}/{full_fn}")
-            
-        if len(dest) > MAX_FILE_NAME_LEN:
-            renamed_file = "rn"
-            
-            i = 1
-            while os.path.exists(f"{dest_folder}/{renamed_file}{i}"):
-                i += 1;
-                
-            if is_known_type:
-                full_fn = f"{renamed_file}{i}.{ext}"
-            else:
-                full_fn = f"{renamed_file}{i}"
+            dest = os.path.join(dest_folder, full_fn)
+        
+        with self.fs_lock:
+            # Reuse the name given to this file on a previous run, so it
+            # can be recognised as up to date
+            renamed_paths = self.get_renamed_paths(dest_folder)
+            if orig_path in renamed_paths:
+                dest = renamed_paths[orig_path]
+            elif len(dest) > MAX_FILE_NAME_LEN:
+                renamed_file = "rn"
+                i = self.next_rename_index(dest_folder)
             
-            dest = os.path.abspath(f"{dest_folder}/{full_fn}")
+                if is_known_type:
+                    full_fn = f"{renamed_file}{i}.{ext}"
+                else:
+                    full_fn = f"{renamed_file}{i}"
+        
+                dest = os.path.join(dest_folder, full_fn)
+
+            if is_up_to_date(dest, header):
+                print(f"'{dest}' is already up to date, skipping")
+                return None
 
-        if not os.path.exists(dest_folder):
             if not DEBUG:
-                os.makedirs(dest_folder)
-            
-        if orig_path != dest:
-            print(f"Warning! File name too long:\n'{orig_path}' shortened to '{dest}'", file=stderr)
-            storage_file_path = os.path.abspath(
-                f"{dest_folder}/{PATH_STORAGE_FN}")
-            with open(storage_file_path, 'a') as path_file:
-                print(f"'{dest}' ==> '{orig_path}'", file=path_file)
-            
-        if not DEBUG:
-            with open(dest, 'w+b') as out_file:
-                shutil.copyfileobj(response, out_file)
-    
-    
-    def get_content_type(self, response):
-        """Return the Content-Type field of the `response`"""
-        content_type = response.info()['Content-Type']
-        content_re = re.compile(r'([^;\s]*)(?:\s*;.*charset=(.*?)(?:\s|;|$))?')
-        content_match = content_re.search(content_type)
-        media_type, encoding = content_match.group(1,2)
-        return (media_type, encoding)
-    
-    
-    def get_filename(self, response, learn_name):
-        """Return filename in Content-Disposition field of `response`"""
-        content_disposition = response.info()['Content-Disposition']
-        fn_re = re.compile(r'filename="(.*?)\.\w*"')
-        amp_re = re.compile(r'&amp;?')
-        if content_disposition == None:
+                os.makedirs(dest_folder, exist_ok=True)
+        
+            if orig_path != dest and orig_path not in renamed_paths:
+                print(f"Warning! File name too long:\n'{orig_path}' shortened to '{dest}'", file=stderr)
+                self.log_rename(dest_folder, dest, orig_path)
+        
+        return dest
+    
+    
+    def save_response(self, response, dest):
+        """
+        Save the body of the streamed `response` to `dest`.
+        
+        The body is written to a temporary file next to `dest`, which only
+        replaces `dest` once the whole body has been received. An
+        interrupted download therefore never leaves a partial file at
+        `dest` for `is_up_to_date` to mistake for a complete one.
+        """
+        # The temporary name is no longer than PATH_STORAGE_FN, so it fits
+        # within the MAX_FOLDER_NAME_LEN budget like the log file does.
+        # Unlike tempfile.mkstemp (always 0600), creating it with mode 0666
+        # lets the umask decide the permissions, as open() would.
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+        while True:
+            part_path = os.path.join(os.path.dirname(dest),
+                                     f"~{secrets.token_hex(4)}.prt")
+            try:
+                fd = os.open(part_path, flags, 0o666)
+            except FileExistsError:
+                continue
+            break
+        try:
+            with os.fdopen(fd, 'wb') as out_file:
+                # Reserve the whole file up front when its final size is
+                # known (i.e. the body is not compressed in transit)
+                content_length = get_content_length(response.headers)
+                is_identity = 'Content-Encoding' not in response.headers
+                if (hasattr(os, 'posix_fallocate') and content_length
+                        and is_identity):
+                    os.posix_fallocate(out_file.fileno(), 0, content_length)
+                response.raw.decode_content = True
+                shutil.copyfileobj(response.raw, out_file, COPY_BUFFER_SIZE)
+                
+                if (content_length is not None and is_identity
+                        and out_file.tell() != content_length):
+                    raise IOError(f"Download of '{dest}' was cut short "
+                                  f"({out_file.tell()} of {content_length} bytes)")
+            os.replace(part_path, dest)
+        except BaseException:
+            os.remove(part_path)
+            raise
+    
+    
+    def next_rename_index(self, dest_folder):
+        """
+        Return the next unused index for a renamed file in `dest_folder`.
+        
+        The folder is only scanned for existing renamed files the first
+        time it is seen, after which indices are handed out from memory.
+        Must be called while holding `fs_lock`.
+        """
+        if dest_folder not in self.rn_counters:
+            if os.path.isdir(dest_folder):
+                existing = [int(rn_match.group(1))
+                            for rn_match in map(rn_fn_re.match,
+                                                os.listdir(dest_folder))
+                            if rn_match]
+            else:
+                existing = []
+            self.rn_counters[dest_folder] = max(existing, default=0) + 1
+        
+        i = self.rn_counters[dest_folder]
+        self.rn_counters[dest_folder] = i + 1
+        return i
+    
+    
+    def get_renamed_paths(self, dest_folder):
+        """
+        Return the renames recorded in `dest_folder`'s PATH_STORAGE_FN log.
+        
+        The mapping from original to shortened paths is read from disk the
+        first time the folder is seen and kept up to date by `log_rename`
+        after that. Must be called while holding `fs_lock`.
+        """
+        if dest_folder not in self.renamed_paths:
+            renamed_paths = {}
+            storage_file_path = os.path.join(dest_folder, PATH_STORAGE_FN)
+            if os.path.isfile(storage_file_path):
+                with open(storage_file_path) as path_file:
+                    for line in path_file:
+                        rename_match = rename_log_re.match(line)
+                        if rename_match:
+                            dest, orig_path = rename_match.group(1, 2)
+                            renamed_paths[orig_path] = dest
+            self.renamed_paths[dest_folder] = renamed_paths
+        return self.renamed_paths[dest_folder]
+    
+    
+    def log_rename(self, dest_folder, dest, orig_path):
+        """
+        Record in `dest_folder`'s PATH_STORAGE_FN log that `orig_path` was
+        saved as `dest`.
+        
+        Log files are kept open (buffered) until `close_path_logs` is
+        called, with at most MAX_OPEN_PATH_LOGS open at once. Must be
+        called while holding `fs_lock`.
+        """
+        path_file = self.path_log_handles.get(dest_folder)
+        if path_file is None:
+            if len(self.path_log_handles) >= MAX_OPEN_PATH_LOGS:
+                # Close the earliest opened log to make room
+                oldest_folder = next(iter(self.path_log_handles))
+                self.path_log_handles.pop(oldest_folder).close()
+            storage_file_path = os.path.join(dest_folder, PATH_STORAGE_FN)
+            path_file = open(storage_file_path, 'a')
+            self.path_log_handles[dest_folder] = path_file
+        print(f"'{dest}' ==> '{orig_path}'", file=path_file)
+        self.get_renamed_paths(dest_folder)[orig_path] = dest
+    
+    
+    def close_path_logs(self):
+        """Flush and close all open PATH_STORAGE_FN log files."""
+        with self.fs_lock:
+            for path_file in self.path_log_handles.values():
+                path_file.close()
+            self.path_log_handles.clear()
+    
+    
+    def get_content_type(self, header):
+        """Return the media type and charset in the Content-Type field of `header`"""
+        # A missing or malformed media type would otherwise be reported as
+        # 'text/plain' by email.message, and saved as a '.txt' file
+        content_type = header.get('Content-Type')
+        if content_type is None or content_type.split(';')[0].count('/') != 1:
+            return (None, None)
+        msg = parse_header(header)
+        return (msg.get_content_type(), msg.get_content_charset())
+    
+    
+    def get_filename(self, header, learn_name):
+        """Return filename in Content-Disposition field of `header`"""
+        filename = parse_header(header).get_filename()
+        if filename == None:
             filename = learn_name
         else:
-            filename = fn_re.search(content_disposition).group(1)
+            filename = os.path.splitext(filename)[0]
         filename = urllib.unquote(filename)
-        filename = amp_re.sub('&', filename)
+        filename = unescape(filename)
         return filename
 
 
 
-def extract_between_res(html_txt, start_re, end_re):
-    """Return the text between `start_re` and `end_re` in `html_txt`."""
-    start_match = start_re.search(html_txt)
-    if start_match != None:
-        start_index = start_match.end()
+def parse_header(header):
+    """
+    Return the Content-* fields of `header` as an email `Message`.
     
-        end_match = end_re.search(html_txt, start_index)
-        if end_match != None:
-            end_index = end_match.start()
-            
-        else:
-            return None
-    else:
+    This lets the standard library parse the parameters of these fields
+    (charset, filename, etc.), including quoted and RFC 2231 encoded ones.
+    """
+    msg = Message()
+    for field in ('Content-Type', 'Content-Disposition'):
+        if field in header:
+            msg[field] = header[field]
+    return msg
+
+
+def get_content_length(header):
+    """
+    Return the Content-Length field of `header` as an int.
+    
+    Return None if the field is missing or malformed (e.g. '10, 10', as
+    urllib3 merges duplicated headers), i.e. the length is unknown.
+    """
+    try:
+        content_length = int(header['Content-Length'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    
+    if content_length < 0:
         return None
+    return content_length
+
 
-    return html_txt[start_index:end_index]
+def is_up_to_date(dest, header):
+    """
+    Return whether `dest` already holds the file described by `header`.
+    
+    The local file is up to date if its size matches the Content-Length
+    and it was written no earlier than the Last-Modified time. If either
+    field is missing, the file is assumed to be out of date.
+    """
+    content_length = get_content_length(header)
+    last_modified = header.get('Last-Modified')
+    if content_length is None or last_modified is None:
+        return False
+    
+    try:
+        dest_stat = os.stat(dest)
+        modified_time = parsedate_to_datetime(last_modified).timestamp()
+    except (OSError, TypeError, ValueError):
+        return False
+    
+    return (dest_stat.st_size == content_length
+            and dest_stat.st_mtime >= modified_time)
 
 
 def extract_course_codes_and_ids(learnUser):
@@ -296,24 +516,11 @@ def extract_course_codes_and_ids(learnUser):
     
     webpage = learnUser.openWebpage("https://learn.canterbury.ac.nz/")
     
-    course_list_str_start = r'(<li class="dropdown nav-item">\s+<a .*>\s+My Courses\s+</a>)'
-    course_list_str_end = r'(</li>)'
-    course_str = r'<a class="dropdown-item" role="menuitem" href=".*?id=(\d*)" title="((?:[A-Z]{4}\d{3})(?:-[A-Z]{4}\d{3})*).*?">(.*?)</a>'
-    
-    course_list_re_start = re.compile(course_list_str_start)
-    course_list_re_end = re.compile(course_list_str_end)
-    course_re = re.compile(course_str)
+    course_list_txt = course_list_re.search(webpage).group(1)
     
-    course_list_txt = extract_between_res(webpage, course_list_re_start, 
-                                          course_list_re_end)
-    
-    groups = course_re.findall(course_list_txt)
-    
-    courses = {}
-    for (course_id, course_code, course_name) in groups:
-        courses[course_code] = (course_id, course_name)
-    
-    return courses
+    return {course_code: (course_id, course_name)
+            for (course_id, course_code, course_name)
+            in course_re.findall(course_list_txt)}
 
 
 def get_resource_url(course_id_number):
@@ -341,17 +548,7 @@ def extract_download_info(courseResourceText):
     """
     item_array = []
 
-    table_str_s = r'<div role="main"><span id="maincontent"></span><table class="generaltable mod_index">'
-    table_str_e = r'</table>\n*</div>'
-    cell_str = r'<td class="cell c1" style="text-align:left;">(.*?)</td>'
-    text_str = r'href="(.*)".*src=".*/(?:icon|f/(\w+))".*alt="([\w|\s]*)" />\s?(.+)</a>'
-    
-    table_re_s = re.compile(table_str_s)
-    table_re_e = re.compile(table_str_e)
-    cell_re = re.compile(cell_str)
-    text_re = re.compile(text_str)
-    
-    table_text = extract_between_res(courseResourceText, table_re_s, table_re_e)
+    table_text = table_re.search(courseResourceText).group(1)
     cell_texts = cell_re.findall(table_text)
     
     for cell_text in cell_texts:
@@ -392,17 +589,16 @@ def get_type(item_type, file_type, url):
     return type
 
 
+@lru_cache(maxsize=256)
 def extract_pdf_url(learnUser, url):
-    """Extract the download link for a PDF file."""
-    learn_url_re = re.compile('https://learn\.canterbury\.ac\.nz/.*')
+    """
+    Extract the download link for a PDF file.
     
+    Results are cached, so a landing page linked to by several items is
+    only fetched once.
+    """
     if learn_url_re.match(url):
         dl_page_text = learnUser.openWebpage(url)
-        with open('ouput.txt', 'w') as opfile:
-            print(dl_page_text.encode('cp850','replace').decode('cp850'), file=opfile)
-        dl_url_re = re.compile(
-            'Click <a href="(.*?)">(.*?)\.pdf</a> link to download the file\.'
-            )
         dl_url_match = dl_url_re.search(dl_page_text)
         dl_url = dl_url_match.group(1)
         
@@ -448,25 +644,35 @@ def extract_pdf_url(learnUser, url):
 #     return downloadLinksArray
 
 
-def download_file(learnUser, url, target_dest, learn_name):
-    """Download a file from learn"""
+def classify_file(learnUser, url):
+    """
+    Find where a file from learn is actually downloaded from.
+    
+    Return the download URL of the file, along with its header if this
+    has already been fetched (otherwise None).
+    """
     header = learnUser.get_header(url)
-    content_type = header['Content-Type']
-    content_re = re.compile(r'([^;\s]*)(?:\s*;.*charset=(.*?)(?:\s|;|$))?')
-    content_match = content_re.search(content_type)
-    media_type, encoding = content_match.group(1,2)
+    media_type, encoding = learnUser.get_content_type(header)
     if media_type == "text/html":
         dl_url = extract_pdf_url(learnUser, url)
     else:
         dl_url = url
-    dest_folder = f"{target_dest}/Single Files/{learn_name}"
-    learnUser.downloadFile(dl_url, dest_folder, learn_name)
-    
     
+    if dl_url == url:
+        return (dl_url, header)
+    else:
+        return (dl_url, None)
+
+
+def fetch_file(learnUser, dl_url, target_dest, learn_name, header=None):
+    """Download a file from learn, given the URL found by `classify_file`"""
+    dest_folder = f"{target_dest}/Single Files/{learn_name}"
+    learnUser.downloadFile(dl_url, dest_folder, learn_name, header)
+
+
 def download_folder(learnUser, url, target_dest, learn_name):
     """Download a folder from learn"""
     print(f"\nExtracting download links for files nested in '{target_dest}' folder")
-    folder_re = re.compile(r'<form.*?action="(.*?)" >\n.*?name="id" value="(\d+)">')
     folder_text = learnUser.openWebpage(url)
     folder_match = folder_re.search(folder_text)
     
@@ -480,26 +686,23 @@ def download_folder(learnUser, url, target_dest, learn_name):
 def download_url(learnUser, url, target_dest, learn_name):
     """Download a pdf file from learn"""
     dl_page_text = learnUser.openWebpage(url)
-    dl_re = re.compile(r'<div role="main">.*?<h2>(.*?)</h2>.*?href="(.*?)"')
     dl_match = dl_re.search(dl_page_text)
     title, target = dl_match.group(1, 2)
     
-    target_dest = f"{target_dest}/Single Files/"
-    dest = os.path.relpath(f"{target_dest}/{title}.url")
-    dest2 = os.path.relpath(forbidden_fn_chars_re.sub('', dest))
+    # `target_dest` is already absolute, so only the drive needs keeping
+    # out of the character stripping
+    dest = os.path.join(target_dest, "Single Files", f"{title}.url")
+    drive, path = os.path.splitdrive(dest)
+    dest2 = drive + path.translate(forbidden_fn_chars_table)
     
     if dest != dest2:
         print("\nWarning! The following characters cannot be used in file and folder names:", file=stderr)
         print(r"    \ / : * ? < > |", file=stderr)
         print(f"The file named '{dest}' has been renamed to '{dest2}' accordingly.\n", file=stderr)
     
-    abs_target_dest = os.path.abspath(target_dest)
-    if not os.path.exists(abs_target_dest):
-            os.makedirs(abs_target_dest)
-    
-    dest = os.path.abspath(dest2)
+    os.makedirs(os.path.dirname(dest2), exist_ok=True)
     
-    with open(dest, 'w') as out_file:
+    with open(dest2, 'w') as out_file:
         print(f"[InternetShortcut]\nURL={target}", file=out_file)
 
 
@@ -509,24 +712,103 @@ def download_page(learnUser, url, target_dest, learn_name):
     learnUser.downloadFile(url, target_dest, learn_name)
 
 
-def download_resource_page(learnUser, target_dest, courseResourceURL):
+# Files are not listed here, as `download_items` downloads them in two
+# stages (`classify_file` then `fetch_file`)
+ITEM_DOWNLOADERS = {
+    "folder": download_folder,
+    "url": download_url,
+    "page": download_page,
+}
+
+
+def download_item(learnUser, item_type, item_url, target_dest, item_name):
+    """Download a single non-file item found on the resources page."""
+    print(f"downloading {item_name}")
+    downloader = ITEM_DOWNLOADERS.get(item_type)
+    if downloader is not None: # ignore items of unknown type
+        downloader(learnUser, item_url, target_dest, item_name)
+
+
+async def download_items(learnUser, target_dest, item_array, classify_sem,
+                         fetch_sem):
+    """
+    Download all items in `item_array` concurrently.
+
+    Each item is downloaded in a worker thread so that the network
+    latency of one request overlaps with the others.
+    
+    Files are downloaded in two stages: classifying the file (finding its
+    download URL) under `classify_sem`, then fetching it under
+    `fetch_sem`. The requests for classifying upcoming files therefore
+    overlap with the downloads of earlier ones. Other items are
+    downloaded in a single step under `fetch_sem`.
+    """
+    async def download(item_type, item_url, item_name):
+        if item_type == "file":
+            print(f"downloading {item_name}")
+            async with classify_sem:
+                dl_url, header = await asyncio.to_thread(
+                    classify_file, learnUser, item_url)
+            async with fetch_sem:
+                await asyncio.to_thread(fetch_file, learnUser, dl_url,
+                                        target_dest, item_name, header)
+        else:
+            async with fetch_sem:
+                await asyncio.to_thread(download_item, learnUser, item_type,
+                                        item_url, target_dest, item_name)
+    
+    await asyncio.gather(*(download(*item) for item in item_array))
+
+
+async def download_resource_page(learnUser, target_dest, courseResourceURL,
+                                 classify_sem, fetch_sem):
     """Download all files and folders found on the resources page."""
     print("Extracting file and folder links from Resource Page")
-    resource_page = learnUser.openWebpage(courseResourceURL)
+    resource_page = await asyncio.to_thread(learnUser.openWebpage,
+                                            courseResourceURL)
     item_array = extract_download_info(resource_page)
     
-    for (item_type, item_url, item_name) in item_array:
-        print(f"downloading {item_name}")
-        if item_type == "file":
-            download_file(learnUser, item_url, target_dest, item_name)
-        elif item_type == "folder":
-            download_folder(learnUser, item_url, target_dest, item_name)
-        elif item_type == "url":
-            download_url(learnUser, item_url, target_dest, item_name)
-        elif item_type == "page":
-            download_page(learnUser, item_url, target_dest, item_name)
-        else:
-            pass # ignore items of unknown type
+    await download_items(learnUser, target_dest, item_array, classify_sem,
+                         fetch_sem)
+
+
+async def download_course(learnUser, courseName, target_dest, courseResourceURL,
+                          classify_sem, fetch_sem):
+    """Download all resources for a single course."""
+    print(f"\n========Finding files for {courseName}========")
+    print(f"Downloading resources to '{target_dest}'")
+    await download_resource_page(learnUser, target_dest, courseResourceURL,
+                                 classify_sem, fetch_sem)
+    await asyncio.to_thread(learnUser.close_path_logs)
+    print(f"Finished downloading files for {courseName}\n")
+
+
+async def download_courses(learnUser, destination_folder, courseNames,
+                           courseResourceURLs):
+    """
+    Download the resources for all selected courses concurrently.
+    
+    All blocking requests run on a shared pool of
+    `MAX_CONCURRENT_DOWNLOADS` threads, which bounds the number of
+    simultaneous connections to Learn across every course.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS))
+    
+    # Split the threads between the two download stages (see
+    # `download_items`), so classifying is never stuck behind downloads
+    classify_sem = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS // 2)
+    fetch_sem = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS
+                                  - MAX_CONCURRENT_DOWNLOADS // 2)
+    
+    await asyncio.gather(*(
+        download_course(learnUser, courseName,
+                        os.path.abspath(destination_folder + '/' + courseName),
+                        courseResourceURL, classify_sem, fetch_sem)
+        for (courseName, courseResourceURL) in zip(courseNames,
+                                                   courseResourceURLs)
+    ))
 
 
 def main():
@@ -541,8 +823,7 @@ def main():
     courses = extract_course_codes_and_ids(learnUser)
     
     print("\nFound the following courses:")
-    course_list = list(courses)
-    course_list.sort()
+    course_list = sorted(courses)
     for (i, course) in enumerate(course_list, start=1):
         print(f"{i}:\t{course}")
     print()
@@ -563,12 +844,8 @@ def main():
     
     # Begin download process
     
-    for (courseName, courseResourceURL) in zip(courseNames, courseResourceURLs):
-        print(f"\n========Finding files for {courseName}========")
-        target_dest = os.path.abspath(destination_folder + '/' + courseName)
-        print(f"Downloading resources to '{target_dest}'")
-        download_resource_page(learnUser, target_dest, courseResourceURL)
-        print(f"Finished downloading files for {courseName}\n")
+    asyncio.run(download_courses(learnUser, destination_folder, courseNames,
+                                 courseResourceURLs))
 
     print("\nFinished!")
     